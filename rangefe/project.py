@@ -8,8 +8,37 @@ from odf.opendocument import load
 from odf.text import P
 import stat
 import shutil
+import tempfile
 import zipfile
 import tarfile
+import hashlib
+import json
+import threading
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'rangefe')
+HASH_CACHE_FILE = os.path.join(CACHE_DIR, 'hash_cache.json')
+HASH_BLOCK_SIZE = 64 * 1024
+SESSION_FILE = os.path.join(CACHE_DIR, 'session.json')
+MAX_CACHED_LISTINGS = 50
+# Directory mtimes this recent may not yet reflect every change on coarse-grained file systems
+RACY_MTIME_NS = 2 * 10**9
+TRASH_DIR = os.path.join(CACHE_DIR, 'trash')
+# Trash directories outside the cache directory, removed by the purger once empty
+TRASH_NAME = f".rangefe-trash-{os.getuid()}"
+TRASH_LOCK = threading.Lock()
+TRASH_MAX_AGE = 24 * 60 * 60
+TRASH_MAX_SIZE = 1024 ** 3
+PURGE_INTERVAL = 60
+PURGE_WORKERS = 4
+# Trash entries without info.json this old were left behind by a crash, not still being created
+TRASH_ENTRY_GRACE = 60
+DOC_CACHE_DIR = os.path.join(CACHE_DIR, 'doc')
+LIBREOFFICE_PROFILE_DIR = os.path.join(CACHE_DIR, 'libreoffice')
+WORKER_START_TIMEOUT = 30
+DOC_CACHE_MAX_SIZE = 100 * 1024 ** 2
 
 class FileExplorer:
     def __init__(self, stdscr):
@@ -21,22 +50,117 @@ class FileExplorer:
         self.file_info = ("", "", "", "")
         self.pop_up_active = False
         self.copied_file_path = None
+        self.hostname = None
+        self.listings = {}
+        self.file_dirs = set()
+        self.restoring = False
+        self.trash_dirs = set()
+        self.trash_history = []
+        self.purge_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.doc_converter = DocConverter()
+
+    def list_directory(self, path):
+        """Return (entries, dirs) for path, reusing the cached listing while its mtime is unchanged."""
+        listing = self.listings.get(path)
+        if not (listing and self.restoring):
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                mtime = None
+            if not listing or mtime is None or not listing_is_current(listing, mtime):
+                listing = read_listing(path, mtime)
+
+        self.listings.pop(path, None)
+        if listing['mtime'] is not None:
+            self.listings[path] = listing
+            while len(self.listings) > MAX_CACHED_LISTINGS:
+                del self.listings[next(iter(self.listings))]
+        return list(listing['entries']), set(listing['dirs'])
 
     def load_files(self):
         try:
-            self.file_list = os.listdir(self.current_path)
-            self.file_list.sort(key=lambda x: x.lower())
+            self.file_list, self.file_dirs = self.list_directory(self.current_path)
         except PermissionError:
-            self.file_list = []
+            self.file_list, self.file_dirs = [], set()
+        self.current_selection = min(self.current_selection, max(len(self.file_list) - 1, 0))
 
     def load_directory_contents(self, path):
         """Load the contents of the selected directory."""
         try:
-            self.selected_directory_contents = os.listdir(path)
-            self.selected_directory_contents.sort(key=lambda x: x.lower())
+            self.selected_directory_contents = self.list_directory(path)[0]
         except PermissionError:
             self.selected_directory_contents = []
 
+    def save_session(self, session_file=SESSION_FILE):
+        """Save the current path, selection and cached listings for the next launch."""
+        snapshot = {
+            'path': self.current_path,
+            'selection': self.file_list[self.current_selection] if self.file_list else None,
+            'listings': self.listings,
+            'trash_dirs': sorted(self.trash_dirs),
+        }
+        try:
+            make_private_dir(os.path.dirname(session_file))
+            tmp_file = session_file + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_file, session_file)
+        except OSError:
+            pass
+
+    def restore_session(self, session_file=SESSION_FILE):
+        """Restore the last session so the first frame needs no file system access.
+
+        The snapshot is checked against the file system in a background thread,
+        and listings are read live again once it finishes.
+        """
+        try:
+            with open(session_file, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            path = snapshot['path']
+            listings = snapshot['listings']
+            trash_dirs = snapshot.get('trash_dirs', [])
+            if not (isinstance(path, str) and isinstance(listings, dict) and isinstance(trash_dirs, list)):
+                raise TypeError("Malformed session snapshot")
+            if not all(isinstance(p, str) and is_valid_listing(l) for p, l in listings.items()):
+                raise TypeError("Malformed session listing")
+            if not all(isinstance(trash_dir, str) for trash_dir in trash_dirs):
+                raise TypeError("Malformed session trash directories")
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return
+
+        self.current_path = path
+        self.listings = listings
+        self.trash_dirs.update(trash_dirs)
+        entries = listings.get(path, {}).get('entries', [])
+        if snapshot.get('selection') in entries:
+            self.current_selection = entries.index(snapshot['selection'])
+        self.restoring = True
+        threading.Thread(target=self.validate_session, args=(path,), daemon=True).start()
+
+    def validate_session(self, path):
+        """Refresh restored listings whose directory changed since they were saved."""
+        for listed_path, listing in list(self.listings.items()):
+            try:
+                mtime = os.stat(listed_path).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime is None:
+                self.listings.pop(listed_path, None)
+            elif not listing_is_current(listing, mtime):
+                try:
+                    self.listings[listed_path] = read_listing(listed_path, mtime)
+                except OSError:
+                    self.listings.pop(listed_path, None)
+
+        if not os.path.isdir(path) and self.current_path == path:
+            while not os.path.isdir(path):
+                path = os.path.dirname(path)
+            self.current_path = path
+            self.current_selection = 0
+        self.restoring = False
+
     def human_readable_size(self, size):
         for unit in ['B', 'KB', 'MB', 'GB', 'TB', 'PB']:
             if size < 1024:
@@ -68,8 +192,9 @@ class FileExplorer:
         self.stdscr.clear()
 
         username = os.getenv("USER") or os.getenv("USERNAME")
-        hostname = subprocess.getoutput("hostname")
-        header = f"{username}@{hostname}: {self.current_path}"
+        if self.hostname is None:
+            self.hostname = subprocess.getoutput("hostname")
+        header = f"{username}@{self.hostname}: {self.current_path}"
         header = header[:max_x - 1]  # Truncate to fit
         self.stdscr.addstr(0, 0, header, curses.color_pair(5))
 
@@ -77,7 +202,11 @@ class FileExplorer:
         self.stdscr.addstr(2, 0, "Parent Directories")
         self.stdscr.addstr(3, 0, '-' * (left_col_width - 1) + '\n')
 
-        parent_dirs = [d for d in os.listdir(os.path.dirname(self.current_path)) if os.path.isdir(os.path.join(os.path.dirname(self.current_path), d))]
+        try:
+            parent_entries, parent_entry_dirs = self.list_directory(os.path.dirname(self.current_path))
+        except PermissionError:
+            parent_entries, parent_entry_dirs = [], set()
+        parent_dirs = [d for d in parent_entries if d in parent_entry_dirs]
         for index, dirname in enumerate(parent_dirs):
             if index >= max_y - 6:
                 break
@@ -94,8 +223,7 @@ class FileExplorer:
         for index, filename in enumerate(self.file_list):
             if index >= max_y - 6:
                 break
-            full_path = os.path.join(self.current_path, filename)
-            is_dir = os.path.isdir(full_path)
+            is_dir = filename in self.file_dirs
             prefix = '[+] ' if is_dir else '    '
             display_str = f"{prefix}{filename}"
             if index == self.current_selection:
@@ -107,7 +235,7 @@ class FileExplorer:
         selected_file = self.file_list[self.current_selection] if self.file_list else None
         if selected_file:
             selected_full_path = os.path.join(self.current_path, selected_file)
-            if os.path.isdir(selected_full_path):
+            if selected_file in self.file_dirs:
                 self.load_directory_contents(selected_full_path)
 
         self.stdscr.addstr(1, left_col_width + center_col_width, '-' * (right_col_width - 1) + '\n')
@@ -137,8 +265,7 @@ class FileExplorer:
         lines = []
         try:
             if filepath.lower().endswith('.doc'):
-                subprocess.run(['libreoffice', '--headless', '--convert-to', 'txt', filepath])
-                with open(filepath.replace('.doc', '.txt'), 'r', encoding='utf-8') as f:
+                with open(self.doc_converter.convert(filepath), 'r', encoding='utf-8') as f:
                     lines = f.readlines()
             elif filepath.lower().endswith('.docx'):
                 doc = docx.Document(filepath)
@@ -206,20 +333,69 @@ class FileExplorer:
     def delete_file(self):
         """Prompt to delete the selected file or directory."""
         selected_file = self.file_list[self.current_selection]
-        full_path = os.path.join(self.current_path, selected_file)
+        self.delete_path(os.path.join(self.current_path, selected_file))
+
+    def delete_path(self, full_path):
+        """Prompt to delete the given path. Return True if it was deleted.
+
+        The path is renamed into a trash directory on the same file system, so
+        deleting returns at once and can be undone until the purger removes it.
+        """
+        name = os.path.basename(full_path)
         if os.path.isdir(full_path):
-            confirm = self.prompt_confirmation(f"Delete directory {selected_file} and all its contents? (y/n)")
+            confirm = self.prompt_confirmation(f"Delete directory {name} and all its contents? (y/n)")
         else:
-            confirm = self.prompt_confirmation(f"Delete file {selected_file}? (y/n)")
+            confirm = self.prompt_confirmation(f"Delete file {name}? (y/n)")
 
         if confirm == 'y':
             try:
-                if os.path.isdir(full_path):
-                    shutil.rmtree(full_path)
-                else:
-                    os.remove(full_path)
+                trash_dir = find_trash_dir(full_path)
+                self.trash_history.append(move_to_trash(full_path, trash_dir))
+                self.trash_dirs.add(trash_dir)
+                self.purge_event.set()
+                return True
             except Exception as e:
-                self.stdscr.addstr(0, 0, f"Error deleting {selected_file}: {str(e)}", curses.color_pair(3))
+                self.stdscr.addstr(0, 0, f"Error deleting {name}: {str(e)}", curses.color_pair(3))
+        return False
+
+    def undo_delete(self):
+        """Restore the most recently deleted file or directory from the trash."""
+        if not self.trash_history:
+            self.stdscr.addstr(0, 0, "Nothing to undo.", curses.color_pair(3))
+            return
+        if not os.path.isdir(self.trash_history[-1]):
+            self.trash_history.pop()
+            self.stdscr.addstr(0, 0, "Cannot undo: the last deleted item was already purged.", curses.color_pair(3))
+            return
+        try:
+            restored_path = restore_from_trash(self.trash_history[-1])
+            self.trash_history.pop()
+            self.stdscr.addstr(0, 0, f"Restored: {restored_path}", curses.color_pair(3))
+        except Exception as e:
+            self.stdscr.addstr(0, 0, f"Error restoring: {str(e)}", curses.color_pair(3))
+
+    def start_purger(self):
+        """Start the background thread that empties the trash."""
+        threading.Thread(target=self.run_purger, daemon=True).start()
+
+    def run_purger(self):
+        """Purge the trash now, after every delete, and every PURGE_INTERVAL seconds."""
+        while not self.stop_event.is_set():
+            self.purge_event.clear()
+            try:
+                purge_trash({TRASH_DIR} | self.trash_dirs, stop_event=self.stop_event)
+                for trash_dir in list(self.trash_dirs):
+                    if not os.path.isdir(trash_dir):
+                        self.trash_dirs.discard(trash_dir)
+            except Exception:
+                # Keep purging later rather than stopping for the rest of the session
+                pass
+            self.purge_event.wait(PURGE_INTERVAL)
+
+    def stop_purger(self):
+        """Ask the purger to stop, leaving the rest of the trash for the next run."""
+        self.stop_event.set()
+        self.purge_event.set()
 
     def prompt_confirmation(self, message):
         """Display a confirmation message and wait for user input."""
@@ -432,11 +608,85 @@ class FileExplorer:
         else:
             self.stdscr.addstr(0, 0, "Selected file is not a supported archive format.", curses.color_pair(3))
 
+    def find_duplicate_files(self):
+        """Scan the current directory tree for duplicate files and show them."""
+        self.stdscr.addstr(0, 0, "Scanning for duplicates...", curses.color_pair(3))
+        self.stdscr.refresh()
+
+        cache = load_hash_cache()
+        try:
+            groups = find_duplicates(self.current_path, cache)
+        except Exception as e:
+            self.stdscr.addstr(0, 0, f"Error finding duplicates: {str(e)}", curses.color_pair(3))
+            return
+        save_hash_cache(cache)
+
+        if groups:
+            self.show_duplicates(groups)
+        else:
+            self.stdscr.addstr(0, 0, "No duplicate files found.", curses.color_pair(3))
+            self.stdscr.refresh()
+            self.stdscr.getch()
+
+    def show_duplicates(self, groups):
+        """Display duplicate groups in a pop-up window. Selected files can be deleted."""
+        self.pop_up_active = True
+        selection = 0
+        top = 0
+
+        while groups:
+            rows = []
+            for size, paths in groups:
+                rows.append((None, f"{len(paths)} files, {self.human_readable_size(size)} each"))
+                for path in paths:
+                    rows.append((path, f"    {os.path.relpath(path, self.current_path)}"))
+            file_rows = [i for i, (path, _) in enumerate(rows) if path]
+            selection = min(selection, len(file_rows) - 1)
+
+            max_y, max_x = self.stdscr.getmaxyx()
+            visible = max_y - 5
+            selected_row = file_rows[selection]
+            if selected_row < top:
+                top = max(selected_row - 1, 0)
+            elif selected_row >= top + visible:
+                top = selected_row - visible + 1
+
+            dup_win = curses.newwin(max_y - 2, max_x - 2, 1, 1)
+            dup_win.border(0)
+            for i, (path, line) in enumerate(rows[top:top + visible]):
+                if top + i == selected_row:
+                    dup_win.addstr(i + 1, 1, line[:max_x - 4], curses.A_REVERSE)
+                elif path is None:
+                    dup_win.addstr(i + 1, 1, line[:max_x - 4], curses.color_pair(3))
+                else:
+                    dup_win.addstr(i + 1, 1, line[:max_x - 4])
+            dup_win.addstr(max_y - 3, 1, "j/k: Move  d: Delete  ESC: Close")
+            dup_win.refresh()
+
+            key = dup_win.getch()
+            if key == 27:
+                break
+            elif key in (curses.KEY_UP, ord('k')) and selection > 0:
+                selection -= 1
+            elif key in (curses.KEY_DOWN, ord('j')) and selection < len(file_rows) - 1:
+                selection += 1
+            elif key == ord('d'):
+                path = rows[selected_row][0]
+                if self.delete_path(path):
+                    for group in groups:
+                        if path in group[1]:
+                            group[1].remove(path)
+                    groups = [group for group in groups if len(group[1]) > 1]
+
+        self.pop_up_active = False
+
     def navigate(self):
         """Main loop for navigating files."""
         while True:
             if not self.pop_up_active:
                 self.display_file_list()
+                # Redraw without a key press once the restored session has been checked
+                self.stdscr.timeout(100 if self.restoring else -1)
                 key = self.stdscr.getch()
                 if key in (curses.KEY_UP, ord('k')) and self.current_selection > 0:
                     self.current_selection -= 1
@@ -483,6 +733,10 @@ class FileExplorer:
                     self.compress_files()
                 elif key == ord('e'):
                     self.decompress_file()
+                elif key == ord('D'):
+                    self.find_duplicate_files()
+                elif key == ord('u'):
+                    self.undo_delete()
                 elif key == ord('q'):
                     break
 
@@ -505,6 +759,7 @@ class FileExplorer:
             "o: Open file with default application",
             "p: Preview file",
             "d: Delete file/directory",
+            "u: Undo last delete",
             "r: Rename file/directory",
             "m: Move file/directory",
             "n: Create new directory",
@@ -514,6 +769,7 @@ class FileExplorer:
             "?: Show this help screen",
             "z: Compress file",
             "e: Decompress file",
+            "D: Find duplicate files",
             "q: Quit"
         ]
 
@@ -546,7 +802,14 @@ def main(stdscr):
     curses.init_pair(5, curses.COLOR_MAGENTA, curses.COLOR_BLACK)
 
     explorer = FileExplorer(stdscr)
-    explorer.navigate()
+    explorer.restore_session()
+    explorer.start_purger()
+    try:
+        explorer.navigate()
+    finally:
+        explorer.stop_purger()
+        explorer.save_session()
+        explorer.doc_converter.close()
 
 def load_current_directory():
     """Load the current directory files."""
@@ -560,5 +823,556 @@ def delete_file(file_path):
     """Delete the specified file."""
     os.remove(file_path)
 
+def make_private_dir(path):
+    """Create path and any missing parents, readable only by the user."""
+    parent = os.path.dirname(path)
+    if parent and not os.path.isdir(parent):
+        make_private_dir(parent)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+
+def read_listing(path, mtime=None):
+    """Read a directory listing: sorted entries, the names that are directories, the mtime and when it was read."""
+    read_ns = time.time_ns()
+    entries = [name for name in os.listdir(path) if name != TRASH_NAME]
+    entries.sort(key=lambda x: x.lower())
+    dirs = [name for name in entries if os.path.isdir(os.path.join(path, name))]
+    return {'mtime': mtime, 'read_ns': read_ns, 'entries': entries, 'dirs': dirs}
+
+def is_valid_listing(listing):
+    """Return True if listing has the shape produced by read_listing."""
+    return (isinstance(listing, dict)
+            and isinstance(listing.get('mtime'), int)
+            and isinstance(listing.get('read_ns'), int)
+            and isinstance(listing.get('entries'), list)
+            and isinstance(listing.get('dirs'), list)
+            and all(isinstance(name, str) for name in listing['entries'] + listing['dirs']))
+
+def listing_is_current(listing, mtime):
+    """Return True if a listing can be trusted for a directory whose mtime is now mtime.
+
+    A listing read within RACY_MTIME_NS of the mtime may have missed a later
+    change that left the mtime unchanged, so it is never trusted.
+    """
+    return listing['mtime'] == mtime and listing['read_ns'] - mtime >= RACY_MTIME_NS
+
+def find_mount_point(path):
+    """Return the mount point of the file system that holds path."""
+    path = os.path.realpath(path)
+    device = os.stat(path).st_dev
+    while path != os.path.dirname(path):
+        parent = os.path.dirname(path)
+        if os.stat(parent).st_dev != device:
+            break
+        path = parent
+    return path
+
+def find_trash_dir(path):
+    """Return a trash directory on the same file system as path, creating it if needed.
+
+    The user's cache directory is preferred, then the root of the file system,
+    and finally a hidden per-user directory next to path, which is needed on
+    shares whose root the user cannot write to.
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    device = os.stat(parent).st_dev
+    candidates = [
+        TRASH_DIR,
+        os.path.join(find_mount_point(parent), TRASH_NAME),
+        os.path.join(parent, TRASH_NAME),
+    ]
+    for trash_dir in candidates:
+        try:
+            make_private_dir(trash_dir)
+            if os.stat(trash_dir).st_dev == device:
+                return trash_dir
+        except OSError:
+            continue
+    raise OSError(f"No trash directory available for {path}")
+
+def move_to_trash(path, trash_dir):
+    """Rename path into a new entry of trash_dir and return the entry.
+
+    info.json is written last, so the purger never sees an entry without its data.
+    """
+    entry = os.path.join(trash_dir, str(time.time_ns()))
+    data = os.path.join(entry, 'data')
+    # The purger may have removed the trash directory since it was found
+    with TRASH_LOCK:
+        make_private_dir(trash_dir)
+        os.mkdir(entry)
+    try:
+        os.rename(path, data)
+    except OSError:
+        os.rmdir(entry)
+        raise
+    try:
+        write_trash_info(entry, {'path': os.path.abspath(path), 'deleted': time.time()})
+    except OSError:
+        os.rename(data, path)
+        shutil.rmtree(entry, ignore_errors=True)
+        raise
+    return entry
+
+def write_trash_info(entry, info):
+    """Write the info.json of a trash entry without ever leaving it half written."""
+    info_file = os.path.join(entry, 'info.json')
+    tmp_file = info_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(info, f)
+    os.replace(tmp_file, info_file)
+
+def restore_from_trash(entry):
+    """Move a trash entry back to its original path and return that path."""
+    with open(os.path.join(entry, 'info.json'), 'r', encoding='utf-8') as f:
+        original_path = json.load(f)['path']
+    if os.path.lexists(original_path):
+        raise FileExistsError(f"{original_path} already exists")
+    os.rename(os.path.join(entry, 'data'), original_path)
+    shutil.rmtree(entry, ignore_errors=True)
+    return original_path
+
+def tree_size(path):
+    """Return the total size of a file or directory tree."""
+    try:
+        size = os.lstat(path).st_size
+    except OSError:
+        return 0
+    for foldername, subfolders, filenames in os.walk(path):
+        for name in subfolders + filenames:
+            try:
+                size += os.lstat(os.path.join(foldername, name)).st_size
+            except OSError:
+                pass
+    return size
+
+def remove_path(path, stop_event=None):
+    """Remove a file or directory tree bottom-up, ignoring errors.
+
+    Stops between directories once stop_event is set.
+    """
+    if os.path.isdir(path) and not os.path.islink(path):
+        for foldername, subfolders, filenames in os.walk(path, topdown=False):
+            if stop_event is not None and stop_event.is_set():
+                return
+            for name in filenames:
+                try:
+                    os.remove(os.path.join(foldername, name))
+                except OSError:
+                    pass
+            for name in subfolders:
+                subfolder = os.path.join(foldername, name)
+                try:
+                    if os.path.islink(subfolder):
+                        os.remove(subfolder)
+                    else:
+                        os.rmdir(subfolder)
+                except OSError:
+                    pass
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+    else:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def purge_trash(trash_dirs, max_age=TRASH_MAX_AGE, max_size=TRASH_MAX_SIZE, workers=PURGE_WORKERS, stop_event=None):
+    """Remove trash entries older than max_age, then the oldest ones until the trash fits in max_size.
+
+    Entries are renamed aside before they are removed, so an entry is either
+    restored by undo or purged, never both. Removal stops early once
+    stop_event is set, and the next run finishes it. Return the number of
+    entries set aside for purging.
+    """
+    entries = []
+    to_remove = []
+    for trash_dir in trash_dirs:
+        try:
+            names = os.listdir(trash_dir)
+        except OSError:
+            continue
+        for name in names:
+            entry = os.path.join(trash_dir, name)
+            # Left behind by an interrupted purge
+            if name.endswith('.purging'):
+                to_remove.append(entry)
+                continue
+            try:
+                created = int(name) / 10**9
+            except ValueError:
+                continue
+            data = os.path.join(entry, 'data')
+            try:
+                with open(os.path.join(entry, 'info.json'), 'r', encoding='utf-8') as f:
+                    info = json.load(f)
+                deleted = float(info['deleted'])
+            except FileNotFoundError:
+                if time.time() - created < TRASH_ENTRY_GRACE:
+                    continue
+                info, deleted = {}, 0
+            except (OSError, ValueError, KeyError, TypeError):
+                # Cannot be restored any more, so purge it first
+                info, deleted = {}, 0
+            else:
+                # Being restored by undo
+                if not os.path.lexists(data):
+                    continue
+            size = info.get('size')
+            if not isinstance(size, int):
+                size = tree_size(data)
+                if info:
+                    info['size'] = size
+                    try:
+                        write_trash_info(entry, info)
+                    except OSError:
+                        pass
+            entries.append((deleted, size, entry))
+
+    entries.sort()
+    now = time.time()
+    total_size = sum(size for _, size, _ in entries)
+    purged = 0
+    for deleted, size, entry in entries:
+        if now - deleted > max_age or total_size > max_size:
+            try:
+                os.rename(entry, entry + '.purging')
+            except OSError:
+                continue
+            to_remove.append(entry + '.purging')
+            total_size -= size
+            purged += 1
+
+    # Split large directories by their children so one huge tree uses every worker
+    tasks = []
+    for entry in to_remove:
+        data = os.path.join(entry, 'data')
+        if os.path.isdir(data) and not os.path.islink(data):
+            try:
+                tasks.extend(os.path.join(data, name) for name in os.listdir(data))
+            except OSError:
+                pass
+    pending = queue.Queue()
+    for task in tasks:
+        pending.put(task)
+
+    def remove_pending():
+        while not (stop_event is not None and stop_event.is_set()):
+            try:
+                path = pending.get_nowait()
+            except queue.Empty:
+                return
+            remove_path(path, stop_event)
+
+    # Daemon threads rather than an executor, so quitting never waits for a purge
+    threads = [threading.Thread(target=remove_pending, daemon=True) for _ in range(min(workers, len(tasks)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if stop_event is not None and stop_event.is_set():
+        return purged
+    for entry in to_remove:
+        remove_path(entry, stop_event)
+
+    with TRASH_LOCK:
+        for trash_dir in trash_dirs:
+            if os.path.basename(trash_dir) == TRASH_NAME:
+                try:
+                    os.rmdir(trash_dir)
+                except OSError:
+                    pass
+    return purged
+
+def partial_hash(file_path, block_size=HASH_BLOCK_SIZE):
+    """Hash the first and last block of a file."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        digest.update(f.read(block_size))
+        f.seek(0, os.SEEK_END)
+        if f.tell() > block_size:
+            f.seek(max(f.tell() - block_size, block_size))
+            digest.update(f.read(block_size))
+    return digest.hexdigest()
+
+def full_hash(file_path, block_size=HASH_BLOCK_SIZE):
+    """Hash the whole file. Return None if it cannot be read."""
+    digest = hashlib.sha256()
+    try:
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                digest.update(block)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+def load_hash_cache(cache_file=HASH_CACHE_FILE):
+    """Load the hash cache, or return an empty one."""
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_hash_cache(cache, cache_file=HASH_CACHE_FILE):
+    """Write the hash cache to disk."""
+    try:
+        make_private_dir(os.path.dirname(cache_file))
+        tmp_file = cache_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(cache, f)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass
+
+def find_duplicates(root, cache=None, block_size=HASH_BLOCK_SIZE):
+    """Return (size, paths) groups of identical files under root, largest first.
+
+    Files are grouped by size, then by a hash of their first and last block,
+    and only files that still collide get a full hash in a process pool.
+    Hashes are stored in cache keyed by path and checked against inode,
+    size and mtime, so unchanged files are never read twice. Files that
+    were never hashed are left out of the cache.
+    """
+    if cache is None:
+        cache = {}
+
+    by_size = {}
+    seen_inodes = set()
+    entries = {}
+    for foldername, subfolders, filenames in os.walk(root):
+        # Deleted files in the trash are not duplicates, and neither are our caches
+        subfolders[:] = [d for d in subfolders
+                         if d != TRASH_NAME and os.path.join(foldername, d) != CACHE_DIR]
+        for filename in filenames:
+            file_path = os.path.join(foldername, filename)
+            try:
+                stat_info = os.lstat(file_path)
+            except OSError:
+                continue
+            if not stat.S_ISREG(stat_info.st_mode) or stat_info.st_size == 0:
+                continue
+            # Hard links share their data, deleting one frees nothing
+            if (stat_info.st_dev, stat_info.st_ino) in seen_inodes:
+                continue
+            seen_inodes.add((stat_info.st_dev, stat_info.st_ino))
+
+            key = [stat_info.st_ino, stat_info.st_size, stat_info.st_mtime_ns]
+            entry = cache.get(file_path)
+            if not entry or entry.get('key') != key:
+                entry = {'key': key}
+            entries[file_path] = entry
+            by_size.setdefault(stat_info.st_size, []).append(file_path)
+
+    by_partial = {}
+    for size, paths in by_size.items():
+        if len(paths) < 2:
+            continue
+        for file_path in paths:
+            entry = entries[file_path]
+            if 'partial' not in entry:
+                try:
+                    entry['partial'] = partial_hash(file_path, block_size)
+                except OSError:
+                    continue
+            # Small files were read whole, so the partial hash is the full hash
+            if size <= 2 * block_size:
+                entry['full'] = entry['partial']
+            by_partial.setdefault((size, entry['partial']), []).append(file_path)
+
+    to_hash = [p for paths in by_partial.values() if len(paths) > 1
+               for p in paths if 'full' not in entries[p]]
+    if to_hash:
+        with ProcessPoolExecutor() as executor:
+            for file_path, digest in zip(to_hash, executor.map(full_hash, to_hash, chunksize=8)):
+                if digest:
+                    entries[file_path]['full'] = digest
+
+    by_full = {}
+    for (size, _), paths in by_partial.items():
+        if len(paths) < 2:
+            continue
+        for file_path in paths:
+            digest = entries[file_path].get('full')
+            if digest:
+                by_full.setdefault((size, digest), []).append(file_path)
+
+    root_prefix = os.path.join(root, '')
+    for file_path in [p for p in cache if p.startswith(root_prefix)]:
+        del cache[file_path]
+    for file_path, entry in entries.items():
+        if 'partial' in entry:
+            cache[file_path] = entry
+
+    groups = [(size, sorted(paths)) for (size, _), paths in by_full.items() if len(paths) > 1]
+    groups.sort(key=lambda group: (-group[0] * (len(group[1]) - 1), group[1]))
+    return groups
+
+class DocConverter:
+    """Convert legacy .doc files to text with a long-lived LibreOffice process.
+
+    The worker is started on first use and reached over a UNO pipe, so only the
+    first conversion pays for LibreOffice start-up. Results are cached by file
+    identity and mtime. Without the uno module every conversion runs a one-off
+    libreoffice process instead, still writing into the cache.
+    """
+
+    def __init__(self, cache_dir=DOC_CACHE_DIR, profile_dir=LIBREOFFICE_PROFILE_DIR):
+        self.cache_dir = cache_dir
+        self.profile_dir = profile_dir
+        self.pipe_name = f"rangefe-{os.getuid()}"
+        self.process = None
+        self.desktop = None
+
+    def cache_path(self, filepath):
+        """Return the cache file for the current version of filepath."""
+        stat_info = os.stat(filepath)
+        return os.path.join(self.cache_dir, f"{stat_info.st_dev}-{stat_info.st_ino}-{stat_info.st_size}-{stat_info.st_mtime_ns}.txt")
+
+    def convert(self, filepath):
+        """Return the path of a UTF-8 text conversion of filepath."""
+        cache_path = self.cache_path(filepath)
+        if os.path.exists(cache_path):
+            # Mark it as recently used for limit_size
+            os.utime(cache_path)
+            return cache_path
+
+        make_private_dir(self.cache_dir)
+        tmp_path = cache_path + '.tmp'
+        try:
+            try:
+                self.convert_with_worker(filepath, tmp_path)
+            except ImportError:
+                self.convert_with_subprocess(filepath, tmp_path)
+            os.replace(tmp_path, cache_path)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        self.remove_stale(cache_path)
+        self.limit_size()
+        return cache_path
+
+    def remove_stale(self, cache_path):
+        """Remove cached conversions of older versions of the same file."""
+        identity = '-'.join(os.path.basename(cache_path).split('-')[:2]) + '-'
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(identity) and os.path.join(self.cache_dir, name) != cache_path:
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+
+    def limit_size(self, max_size=DOC_CACHE_MAX_SIZE):
+        """Remove the least recently used conversions until the cache fits in max_size."""
+        cached = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.txt'):
+                try:
+                    stat_info = os.stat(os.path.join(self.cache_dir, name))
+                except OSError:
+                    continue
+                cached.append((stat_info.st_mtime, stat_info.st_size, name))
+
+        total_size = sum(size for _, size, _ in cached)
+        for _, size, name in sorted(cached):
+            if total_size <= max_size:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+                total_size -= size
+            except OSError:
+                pass
+
+    def connect(self):
+        """Return the LibreOffice desktop of the worker, starting the worker if needed."""
+        import uno
+
+        if self.desktop is not None:
+            return self.desktop
+
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext('com.sun.star.bridge.UnoUrlResolver', local_context)
+        url = f"uno:pipe,name={self.pipe_name};urp;StarOffice.ComponentContext"
+
+        deadline = None
+        while True:
+            try:
+                context = resolver.resolve(url)
+                break
+            except Exception:
+                if deadline is None:
+                    self.start_worker()
+                    deadline = time.monotonic() + WORKER_START_TIMEOUT
+                elif self.process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("Could not start the LibreOffice conversion worker")
+                time.sleep(0.1)
+
+        self.desktop = context.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', context)
+        return self.desktop
+
+    def start_worker(self):
+        """Start a headless LibreOffice listening on the worker pipe."""
+        import uno
+
+        make_private_dir(self.profile_dir)
+        self.process = subprocess.Popen([
+            'libreoffice', '--headless', '--invisible', '--nologo', '--norestore',
+            f"--accept=pipe,name={self.pipe_name};urp;StarOffice.ComponentContext",
+            f"-env:UserInstallation={uno.systemPathToFileUrl(self.profile_dir)}",
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def convert_with_worker(self, filepath, output_path, retry=True):
+        """Convert filepath to text through the worker."""
+        import uno
+        from com.sun.star.beans import PropertyValue
+        from com.sun.star.lang import DisposedException
+
+        def properties(**kwargs):
+            return tuple(PropertyValue(Name=name, Value=value) for name, value in kwargs.items())
+
+        desktop = self.connect()
+        try:
+            doc = desktop.loadComponentFromURL(uno.systemPathToFileUrl(os.path.abspath(filepath)), '_blank', 0,
+                                               properties(Hidden=True, ReadOnly=True))
+        except DisposedException:
+            # The worker exited since the last conversion, connect again or start a new one
+            self.desktop = None
+            if not retry:
+                raise
+            return self.convert_with_worker(filepath, output_path, retry=False)
+        if doc is None:
+            raise RuntimeError(f"LibreOffice could not load {os.path.basename(filepath)}")
+        try:
+            doc.storeToURL(uno.systemPathToFileUrl(output_path),
+                           properties(FilterName='Text (encoded)', FilterOptions='UTF8'))
+        finally:
+            doc.close(True)
+
+    def convert_with_subprocess(self, filepath, output_path):
+        """Convert filepath to text with a one-off libreoffice process."""
+        out_dir = tempfile.mkdtemp(dir=self.cache_dir)
+        try:
+            subprocess.run(['libreoffice', '--headless', '--convert-to', 'txt:Text (encoded):UTF8', '--outdir', out_dir, filepath],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            txt_name = os.path.splitext(os.path.basename(filepath))[0] + '.txt'
+            os.replace(os.path.join(out_dir, txt_name), output_path)
+        finally:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+    def close(self):
+        """Stop the worker if this converter started it."""
+        self.desktop = None
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
 if __name__ == '__main__':
     curses.wrapper(main)
@@ -5,10 +5,14 @@ from unittest.mock import patch, MagicMock
 import shutil
 import zipfile
 import tarfile
+import tempfile
+import time
+import stat
+import threading
 
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
-from project import FileExplorer, load_current_directory, create_new_directory, delete_file  # Import the standalone functions
+from project import FileExplorer, load_current_directory, create_new_directory, delete_file, find_duplicates, move_to_trash, purge_trash, remove_path, find_trash_dir, TRASH_NAME, DocConverter  # Import the standalone functions
 
 class TestFileExplorer(unittest.TestCase):
 
@@ -69,20 +73,81 @@ class TestFileExplorer(unittest.TestCase):
             self.explorer.create_directory()
             mock_mkdir.assert_called_once_with(os.path.join(self.explorer.current_path, 'new_directory'))
 
-    @patch('shutil.rmtree')
-    @patch('os.remove')
-    def test_delete_file(self, mock_remove, mock_rmtree):
+    def test_delete_file(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.explorer.current_path = tmp_dir
         self.explorer.file_list = ['file_to_delete.txt']
         self.explorer.current_selection = 0
+        file_path = os.path.join(tmp_dir, 'file_to_delete.txt')
 
-        with open(os.path.join(self.explorer.current_path, 'file_to_delete.txt'), 'w') as f:
+        with open(file_path, 'w') as f:
             f.write('dummy content')
 
-        with patch('project.FileExplorer.prompt_confirmation', return_value='y'):
+        with patch('project.TRASH_DIR', os.path.join(tmp_dir, 'trash')), \
+                patch('project.FileExplorer.prompt_confirmation', return_value='y'):
             self.explorer.delete_file()
-            mock_remove.assert_called_once_with(os.path.join(self.explorer.current_path, 'file_to_delete.txt'))
+        self.assertFalse(os.path.exists(file_path))
+        self.assertEqual(len(self.explorer.trash_history), 1)
+        self.assertTrue(self.explorer.purge_event.is_set())
+
+        self.explorer.undo_delete()
+        with open(file_path) as f:
+            self.assertEqual(f.read(), 'dummy content')
+        self.assertEqual(self.explorer.trash_history, [])
+
+    def test_undo_delete_fails(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        file_path = os.path.join(tmp_dir, 'file_to_delete.txt')
+        with open(file_path, 'w') as f:
+            f.write('dummy content')
+        self.explorer.trash_history.append(move_to_trash(file_path, tmp_dir))
+
+        # A new file now has the original name
+        with open(file_path, 'w') as f:
+            f.write('new content')
+        self.explorer.undo_delete()
+        self.assertEqual(len(self.explorer.trash_history), 1)
+
+        os.remove(file_path)
+        self.explorer.undo_delete()
+        self.assertEqual(self.explorer.trash_history, [])
+        with open(file_path) as f:
+            self.assertEqual(f.read(), 'dummy content')
+
+    def test_run_purger_survives_errors(self):
+        class StopPurger(Exception):
+            pass
+
+        self.explorer.purge_event = MagicMock()
+        self.explorer.purge_event.wait.side_effect = [False, StopPurger]
+        with patch('project.purge_trash', side_effect=[KeyError('deleted'), 0]) as mock_purge:
+            with self.assertRaises(StopPurger):
+                self.explorer.run_purger()
+        self.assertEqual(mock_purge.call_count, 2)
+
+    def test_stop_purger(self):
+        self.explorer.stop_purger()
+        with patch('project.purge_trash') as mock_purge:
+            self.explorer.run_purger()
+            mock_purge.assert_not_called()
+
+    def test_undo_delete_purged(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        file_path = os.path.join(tmp_dir, 'file_to_delete.txt')
+        with open(file_path, 'w') as f:
+            f.write('dummy content')
+        self.explorer.trash_history.append(move_to_trash(file_path, tmp_dir))
+        purge_trash([tmp_dir], max_age=-1)
+
+        self.explorer.undo_delete()
+        self.assertEqual(self.explorer.trash_history, [])
+        self.assertIn('already purged', self.mock_stdscr.addstr.call_args[0][2])
 
     def test_delete_file_no_confirmation(self):
+        self.addCleanup(os.remove, os.path.join(self.explorer.current_path, 'file_to_delete.txt'))
         with open(os.path.join(self.explorer.current_path, 'file_to_delete.txt'), 'w') as f:
             f.write('dummy content')
 
@@ -162,5 +227,388 @@ class TestStandaloneFunctions(unittest.TestCase):
             delete_file(test_file)
             mock_remove.assert_called_once_with(test_file)
 
+class TestSession(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.session_file = os.path.join(self.tmp_dir, 'session.json')
+        self.browse_dir = os.path.join(self.tmp_dir, 'browse')
+        os.makedirs(os.path.join(self.browse_dir, 'sub'))
+        for name in ('a.txt', 'b.txt'):
+            with open(os.path.join(self.browse_dir, name), 'w') as f:
+                f.write('dummy content')
+        # Age the directory so its mtime is trusted by the listing cache
+        os.utime(self.browse_dir, (1609459200, 1609459200))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_list_directory_cached(self):
+        explorer = FileExplorer(MagicMock())
+        self.assertEqual(explorer.list_directory(self.browse_dir), (['a.txt', 'b.txt', 'sub'], {'sub'}))
+        with patch('os.listdir') as mock_listdir:
+            self.assertEqual(explorer.list_directory(self.browse_dir), (['a.txt', 'b.txt', 'sub'], {'sub'}))
+            mock_listdir.assert_not_called()
+
+    def test_list_directory_racy_mtime(self):
+        explorer = FileExplorer(MagicMock())
+        os.utime(self.browse_dir, ns=(time.time_ns(), time.time_ns()))
+        mtime = os.stat(self.browse_dir).st_mtime_ns
+        self.assertEqual(explorer.list_directory(self.browse_dir)[0], ['a.txt', 'b.txt', 'sub'])
+
+        # A change within the same mtime tick, seen after the racy window has passed
+        with open(os.path.join(self.browse_dir, 'c.txt'), 'w') as f:
+            f.write('dummy content')
+        os.utime(self.browse_dir, ns=(mtime, mtime))
+        with patch('time.time_ns', return_value=mtime + 5 * 10**9):
+            self.assertEqual(explorer.list_directory(self.browse_dir)[0], ['a.txt', 'b.txt', 'c.txt', 'sub'])
+            # The listing read after the window is trusted from now on
+            with patch('os.listdir') as mock_listdir:
+                explorer.list_directory(self.browse_dir)
+                mock_listdir.assert_not_called()
+
+    def test_save_and_restore_session(self):
+        explorer = FileExplorer(MagicMock())
+        explorer.current_path = self.browse_dir
+        explorer.load_files()
+        explorer.current_selection = 1
+        explorer.save_session(self.session_file)
+
+        restored = FileExplorer(MagicMock())
+        with patch('threading.Thread'):
+            restored.restore_session(self.session_file)
+        self.assertTrue(restored.restoring)
+        self.assertEqual(restored.current_path, self.browse_dir)
+        self.assertEqual(restored.current_selection, 1)
+        with patch('os.listdir') as mock_listdir, patch('os.stat') as mock_stat:
+            restored.load_files()
+            mock_listdir.assert_not_called()
+            mock_stat.assert_not_called()
+        self.assertEqual(restored.file_list, ['a.txt', 'b.txt', 'sub'])
+
+    def test_restore_session_malformed(self):
+        snapshots = [
+            '{"path": "/", "listings": []}',
+            '{"path": "/", "listings": {"/": {"entries": ["a"]}}}',
+            '{"path": 1, "listings": {}}',
+            '{"path": "/", "listings": {}, "trash_dirs": "/tmp"}',
+            '[]',
+        ]
+        for snapshot in snapshots:
+            with open(self.session_file, 'w') as f:
+                f.write(snapshot)
+            explorer = FileExplorer(MagicMock())
+            with patch('threading.Thread') as mock_thread:
+                explorer.restore_session(self.session_file)
+                mock_thread.assert_not_called()
+            self.assertFalse(explorer.restoring)
+            self.assertEqual(explorer.listings, {})
+
+    def test_validate_session(self):
+        explorer = FileExplorer(MagicMock())
+        explorer.current_path = self.browse_dir
+        explorer.load_files()
+        explorer.save_session(self.session_file)
+        os.remove(os.path.join(self.browse_dir, 'a.txt'))
+        os.utime(self.browse_dir, (1609459300, 1609459300))
+
+        restored = FileExplorer(MagicMock())
+        with patch('threading.Thread'):
+            restored.restore_session(self.session_file)
+        restored.validate_session(self.browse_dir)
+        self.assertFalse(restored.restoring)
+        restored.load_files()
+        self.assertEqual(restored.file_list, ['b.txt', 'sub'])
+
+    def test_validate_session_missing_path(self):
+        explorer = FileExplorer(MagicMock())
+        explorer.current_path = os.path.join(self.browse_dir, 'sub')
+        explorer.load_files()
+        explorer.save_session(self.session_file)
+        os.rmdir(os.path.join(self.browse_dir, 'sub'))
+
+        restored = FileExplorer(MagicMock())
+        with patch('threading.Thread'):
+            restored.restore_session(self.session_file)
+        restored.validate_session(restored.current_path)
+        self.assertEqual(restored.current_path, self.browse_dir)
+
+class TestTrash(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.trash_dir = os.path.join(self.tmp_dir, 'trash')
+        os.mkdir(self.trash_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def make_tree(self, name):
+        path = os.path.join(self.tmp_dir, name)
+        for sub in ('a', 'b'):
+            os.makedirs(os.path.join(path, sub))
+            with open(os.path.join(path, sub, 'file.txt'), 'w') as f:
+                f.write('dummy content')
+        return path
+
+    def test_find_trash_dir_same_device(self):
+        path = self.make_tree('tree')
+        with patch('project.TRASH_DIR', self.trash_dir):
+            self.assertEqual(find_trash_dir(path), self.trash_dir)
+
+    def test_find_trash_dir_other_device(self):
+        path = self.make_tree('tree')
+        real_stat = os.stat
+
+        def fake_stat(p, *args, **kwargs):
+            stat_info = real_stat(p, *args, **kwargs)
+            if p == self.trash_dir:
+                return os.stat_result(stat_info[:2] + (stat_info.st_dev + 1,) + stat_info[3:10])
+            return stat_info
+
+        # A mount root the trash cannot be created in
+        unwritable_root = os.path.join(path, 'a', 'file.txt')
+        with patch('project.TRASH_DIR', self.trash_dir), \
+                patch('project.find_mount_point', return_value=unwritable_root), \
+                patch('os.stat', side_effect=fake_stat):
+            self.assertEqual(find_trash_dir(path), os.path.join(self.tmp_dir, TRASH_NAME))
+
+    def test_purge_trash_removes_empty_trash_dir(self):
+        trash_dir = os.path.join(self.tmp_dir, TRASH_NAME)
+        move_to_trash(self.make_tree('tree'), trash_dir)
+        self.assertEqual(purge_trash([self.trash_dir, trash_dir], max_age=-1), 1)
+        self.assertFalse(os.path.exists(trash_dir))
+        self.assertTrue(os.path.isdir(self.trash_dir))
+
+    def test_purge_trash_keeps_recent(self):
+        entry = move_to_trash(self.make_tree('tree'), self.trash_dir)
+        self.assertEqual(purge_trash([self.trash_dir]), 0)
+        self.assertTrue(os.path.isdir(os.path.join(entry, 'data', 'a')))
+
+    def test_purge_trash_skips_incomplete_entries(self):
+        entry = os.path.join(self.trash_dir, '1')
+        os.mkdir(entry)
+        with open(os.path.join(entry, 'info.json'), 'w') as f:
+            f.write('{"path": "tree", "deleted": 0}')
+        self.assertEqual(purge_trash([self.trash_dir], max_size=0), 0)
+        with open(os.path.join(entry, 'info.json')) as f:
+            self.assertNotIn('size', f.read())
+
+    def test_purge_trash_unreadable_info(self):
+        entry = move_to_trash(self.make_tree('tree'), self.trash_dir)
+        with open(os.path.join(entry, 'info.json'), 'w') as f:
+            f.write('{"path": "tr')
+        self.assertEqual(purge_trash([self.trash_dir]), 1)
+        self.assertEqual(os.listdir(self.trash_dir), [])
+
+    def test_purge_trash_abandoned_entry(self):
+        recent = os.path.join(self.trash_dir, str(time.time_ns()))
+        abandoned = os.path.join(self.trash_dir, str(time.time_ns() - 3600 * 10**9))
+        for entry in (recent, abandoned):
+            os.makedirs(os.path.join(entry, 'data'))
+        self.assertEqual(purge_trash([self.trash_dir]), 1)
+        self.assertEqual(os.listdir(self.trash_dir), [os.path.basename(recent)])
+
+    def test_purge_trash_writes_info_atomically(self):
+        entry = move_to_trash(self.make_tree('tree'), self.trash_dir)
+        purge_trash([self.trash_dir])
+        self.assertEqual(sorted(os.listdir(entry)), ['data', 'info.json'])
+        with open(os.path.join(entry, 'info.json')) as f:
+            self.assertIn('size', f.read())
+
+    def test_purge_trash_stops(self):
+        entry = move_to_trash(self.make_tree('tree'), self.trash_dir)
+        stop_event = threading.Event()
+        stop_event.set()
+        self.assertEqual(purge_trash([self.trash_dir], max_age=-1, stop_event=stop_event), 1)
+        self.assertTrue(os.path.isdir(os.path.join(entry + '.purging', 'data', 'a')))
+        # The next run finishes the interrupted purge
+        purge_trash([self.trash_dir])
+        self.assertEqual(os.listdir(self.trash_dir), [])
+
+    def test_remove_path_keeps_links(self):
+        path = self.make_tree('tree')
+        target = self.make_tree('target')
+        os.symlink(target, os.path.join(path, 'link'))
+        remove_path(path)
+        self.assertFalse(os.path.lexists(path))
+        self.assertTrue(os.path.isfile(os.path.join(target, 'a', 'file.txt')))
+
+    def test_purge_trash_by_age(self):
+        move_to_trash(self.make_tree('tree'), self.trash_dir)
+        self.assertEqual(purge_trash([self.trash_dir], max_age=-1), 1)
+        self.assertEqual(os.listdir(self.trash_dir), [])
+
+    def test_purge_trash_by_size(self):
+        old_entry = move_to_trash(self.make_tree('old'), self.trash_dir)
+        new_entry = move_to_trash(self.make_tree('new'), self.trash_dir)
+        with open(os.path.join(old_entry, 'info.json'), 'w') as f:
+            f.write('{"path": "old", "deleted": 0, "size": 10}')
+        with open(os.path.join(new_entry, 'info.json'), 'w') as f:
+            f.write('{"path": "new", "deleted": 1, "size": 10}')
+        self.assertEqual(purge_trash([self.trash_dir], max_age=float('inf'), max_size=15), 1)
+        self.assertEqual(os.listdir(self.trash_dir), [os.path.basename(new_entry)])
+
+class TestDocConverter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.tmp_dir, 'docs')
+        os.mkdir(self.source_dir)
+        self.doc_path = os.path.join(self.source_dir, 'report.doc')
+        with open(self.doc_path, 'w') as f:
+            f.write('dummy content')
+        self.converter = DocConverter(cache_dir=os.path.join(self.tmp_dir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def fake_libreoffice(self, args, **kwargs):
+        out_dir = args[args.index('--outdir') + 1]
+        with open(os.path.join(out_dir, 'report.txt'), 'w') as f:
+            f.write('converted text')
+
+    @patch('project.DocConverter.convert_with_worker', side_effect=ImportError)
+    def test_convert_cached(self, mock_worker):
+        with patch('subprocess.run', side_effect=self.fake_libreoffice) as mock_run:
+            cache_path = self.converter.convert(self.doc_path)
+            self.assertEqual(self.converter.convert(self.doc_path), cache_path)
+            mock_run.assert_called_once()
+        with open(cache_path) as f:
+            self.assertEqual(f.read(), 'converted text')
+        self.assertEqual(os.listdir(self.source_dir), ['report.doc'])
+
+    @patch('project.DocConverter.convert_with_worker', side_effect=ImportError)
+    def test_convert_removes_stale(self, mock_worker):
+        with patch('subprocess.run', side_effect=self.fake_libreoffice):
+            old_path = self.converter.convert(self.doc_path)
+            os.utime(self.doc_path, (1609459200, 1609459200))
+            new_path = self.converter.convert(self.doc_path)
+        self.assertNotEqual(old_path, new_path)
+        self.assertEqual(os.listdir(self.converter.cache_dir), [os.path.basename(new_path)])
+
+    @patch('project.DocConverter.convert_with_worker', side_effect=ImportError)
+    def test_convert_private_cache_dir(self, mock_worker):
+        with patch('subprocess.run', side_effect=self.fake_libreoffice):
+            self.converter.convert(self.doc_path)
+        self.assertEqual(stat.S_IMODE(os.stat(self.converter.cache_dir).st_mode), 0o700)
+
+    def test_limit_size(self):
+        os.makedirs(self.converter.cache_dir)
+        for i, name in enumerate(['old.txt', 'used.txt', 'new.txt']):
+            path = os.path.join(self.converter.cache_dir, name)
+            with open(path, 'w') as f:
+                f.write('x' * 10)
+            os.utime(path, (1609459200 + i, 1609459200 + i))
+        os.utime(os.path.join(self.converter.cache_dir, 'used.txt'))
+        self.converter.limit_size(max_size=20)
+        self.assertEqual(sorted(os.listdir(self.converter.cache_dir)), ['new.txt', 'used.txt'])
+
+    def fake_uno_modules(self):
+        class DisposedException(Exception):
+            pass
+
+        uno = MagicMock()
+        uno.systemPathToFileUrl = lambda path: 'file://' + path
+        lang = MagicMock(DisposedException=DisposedException)
+        modules = {'uno': uno, 'com': MagicMock(), 'com.sun': MagicMock(), 'com.sun.star': MagicMock(),
+                   'com.sun.star.beans': MagicMock(), 'com.sun.star.lang': lang}
+        return modules, DisposedException
+
+    def fake_desktop(self):
+        def store(url, properties):
+            with open(url[len('file://'):], 'w') as f:
+                f.write('converted text')
+
+        desktop = MagicMock()
+        desktop.loadComponentFromURL.return_value.storeToURL.side_effect = store
+        return desktop
+
+    def test_convert_restarts_worker(self):
+        modules, DisposedException = self.fake_uno_modules()
+        stale_desktop = MagicMock()
+        stale_desktop.loadComponentFromURL.side_effect = DisposedException
+        with patch.dict(sys.modules, modules), \
+                patch.object(self.converter, 'connect', side_effect=[stale_desktop, self.fake_desktop()]) as mock_connect:
+            cache_path = self.converter.convert(self.doc_path)
+        self.assertEqual(mock_connect.call_count, 2)
+        with open(cache_path) as f:
+            self.assertEqual(f.read(), 'converted text')
+
+    def test_convert_unreadable_document(self):
+        modules, DisposedException = self.fake_uno_modules()
+        desktop = MagicMock()
+        desktop.loadComponentFromURL.return_value = None
+        self.converter.desktop = desktop
+        with patch.dict(sys.modules, modules), \
+                patch.object(self.converter, 'connect', return_value=desktop) as mock_connect:
+            with self.assertRaisesRegex(RuntimeError, 'could not load report.doc'):
+                self.converter.convert(self.doc_path)
+        mock_connect.assert_called_once()
+        self.assertIs(self.converter.desktop, desktop)
+        self.assertEqual(os.listdir(self.converter.cache_dir), [])
+
+class TestFindDuplicates(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_find_duplicates(self):
+        a = self.write('a.txt', b'same content')
+        b = self.write('sub/b.txt', b'same content')
+        self.write('c.txt', b'diff content')
+        self.write('d.txt', b'other')
+        self.assertEqual(find_duplicates(self.tmp_dir), [(12, sorted([a, b]))])
+
+    def test_find_duplicates_same_ends(self):
+        # Files that only differ in the middle need a full hash
+        a = self.write('a.bin', b'x' * 16 + b'1' + b'x' * 16)
+        b = self.write('b.bin', b'x' * 16 + b'2' + b'x' * 16)
+        c = self.write('c.bin', b'x' * 16 + b'1' + b'x' * 16)
+        self.assertEqual(find_duplicates(self.tmp_dir, block_size=4), [(33, [a, c])])
+
+    def test_find_duplicates_uses_cache(self):
+        a = self.write('a.txt', b'same content')
+        b = self.write('b.txt', b'same content')
+        cache = {}
+        find_duplicates(self.tmp_dir, cache)
+        self.assertIn('full', cache[a])
+        with patch('project.partial_hash') as mock_partial:
+            self.assertEqual(find_duplicates(self.tmp_dir, cache), [(12, [a, b])])
+            mock_partial.assert_not_called()
+
+    def test_find_duplicates_caches_hashed_files_only(self):
+        a = self.write('a.txt', b'same content')
+        b = self.write('b.txt', b'same content')
+        self.write('c.txt', b'unique size')
+        cache = {os.path.join(self.tmp_dir, 'gone.txt'): {'key': [1, 2, 3], 'partial': 'x'}}
+        find_duplicates(self.tmp_dir, cache)
+        self.assertEqual(sorted(cache), [a, b])
+
+    def test_find_duplicates_skips_trash(self):
+        a = self.write('a.txt', b'same content')
+        self.write(os.path.join(TRASH_NAME, '1', 'data'), b'same content')
+        self.write(os.path.join('cache', 'trash', '2', 'data'), b'same content')
+        with patch('project.CACHE_DIR', os.path.join(self.tmp_dir, 'cache')):
+            self.assertEqual(find_duplicates(self.tmp_dir), [])
+        self.write('b.txt', b'same content')
+        with patch('project.CACHE_DIR', os.path.join(self.tmp_dir, 'cache')):
+            self.assertEqual(find_duplicates(self.tmp_dir), [(12, [a, os.path.join(self.tmp_dir, 'b.txt')])])
+
+    def test_find_duplicates_skips_hard_links(self):
+        a = self.write('a.txt', b'same content')
+        os.link(a, os.path.join(self.tmp_dir, 'b.txt'))
+        self.assertEqual(find_duplicates(self.tmp_dir), [])
+
 if __name__ == '__main__':
     unittest.main()